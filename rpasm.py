@@ -1,17 +1,17 @@
 #!/usr/bin/env python
 
+import re
 from argparse import ArgumentParser
-from dataclasses import dataclass
-from typing import Generator, Iterator, TextIO
+from typing import Any, BinaryIO, Callable, Generator, Iterator, Literal, TextIO, TypeVar, overload
 
-PREFIXES = [
+PREFIXES = frozenset([
     "$",
     "@",
     "?",
     ":",
     "#",
     ".",
-]
+])
 TYPES = {
     "byte": "b",
     "word": "w",
@@ -32,15 +32,6 @@ SIMPLE_BINARY_OPERATORS = {
     "+": "add",
     "-": "sub",
 }
-FUNCTIONS = [
-    "global",
-    "data",
-    "call",
-    "syscall",
-    "jmp",
-    "jmpif",
-    "return",
-]
 CALL_ARG_REGS = [
     "rdi",
     "rsi",
@@ -59,100 +50,256 @@ SYSCALL_ARG_REGS = [
     "r9",
 ]
 
-def asm_str(val: str) -> str:
-    if not val.endswith("\0"):
-        val += "\0"
-    asm_str = "db "
-    for c in val:
-        if asm_str != "db ":
-            asm_str += ", "
-        asm_str += str(ord(c))
-    return asm_str
-
-class Token:
-    pass
-
-@dataclass
-class FunctionToken(Token):
-    name: str
-    args: list[str | int]
-
-@dataclass
-class ValueToken(Token):
-    prefix: str | None
-    value: str | int
-
-@dataclass
-class StringToken(Token):
-    value: str
+CALL_ARG_POPS = tuple(f"pop {reg}" for reg in CALL_ARG_REGS)
+CALL_ARG_PUSHES = tuple(f"push {reg}" for reg in CALL_ARG_REGS)
+SYSCALL_ARG_POPS = tuple(f"pop {reg}" for reg in SYSCALL_ARG_REGS)
+LOAD_BY_SIZE = {size: f"mov {reg}, {size} [rax]" for size, reg in RDI_BY_SIZE.items()}
+SET_BY_OPERATOR = {op: f"set{cc} sil" for op, cc in CONDITIONAL_OPERATORS.items()}
+BINARY_BY_OPERATOR = {op: f"{instr} rax, rdi" for op, instr in SIMPLE_BINARY_OPERATORS.items()}
+
+CHAR_VALUE = 0
+CHAR_SPACE = 1
+CHAR_COMMENT = 2
+CHAR_STRING = 3
+CHAR_CLASSES = bytes(
+    CHAR_SPACE if bytes([c]).isspace()
+    else CHAR_COMMENT if c == ord(";")
+    else CHAR_STRING if c == ord('"')
+    else CHAR_VALUE
+    for c in range(256)
+)
+
+SPACE_RE = re.compile(rb"\s+")
+VALUE_RE = re.compile(rb"([%s])?([^\s(]*)(\()?" % re.escape("".join(sorted(PREFIXES)).encode()))
+ARG_RE = re.compile(rb"\s*(?:(?P<close>\))|(?P<arg>[^,)]*)(?P<comma>,?))")
+
+Emitter = Callable[[str], None]
+
+def asm_str(val: str | bytes) -> str:
+    if isinstance(val, str):
+        val = val.encode("utf-8")
+    if not val.endswith(b"\0"):
+        val += b"\0"
+    return "db " + ", ".join(map(str, val))
+
+def fn_global(emit: Emitter, label: str) -> None:
+    emit(f"global {label}")
+
+def fn_data(emit: Emitter, *args: str | int) -> None:
+    if len(args) < 2 or type(args[0]) is not str or args[0] not in TYPES or any(type(arg) is not int for arg in args[1:]):
+        raise Exception("invalid function")
+    emit(f"d{TYPES[args[0]]} {', '.join(map(str, args[1:]))}")
+
+def fn_call(emit: Emitter, label: str, n_args: int) -> None:
+    for i in reversed(range(n_args)):
+        emit(CALL_ARG_POPS[i])
+    emit(f"call {label}")
+    emit("push rax")
+
+def fn_syscall(emit: Emitter, n_args: int) -> None:
+    for i in reversed(range(n_args)):
+        emit(SYSCALL_ARG_POPS[i])
+    emit("syscall")
+    emit("push rax")
+
+def fn_jmp(emit: Emitter, label: str) -> None:
+    emit(f"jmp {label}")
+
+def fn_jmpif(emit: Emitter, label: str) -> None:
+    emit("pop rax")
+    emit("test rax, rax")
+    emit(f"jnz {label}")
+
+def fn_return(emit: Emitter) -> None:
+    emit("pop rax")
+    emit("ret")
+
+def fn_args(emit: Emitter, n_args: int) -> None:
+    for i in range(n_args):
+        emit(CALL_ARG_PUSHES[i])
+
+def str_load(emit: Emitter, value: str) -> None:
+    if value not in LOAD_BY_SIZE:
+        raise Exception("invalid string value")
+    emit("pop rax")
+    emit("xor rdi, rdi")
+    emit(LOAD_BY_SIZE[value])
+    emit("push rdi")
+
+def str_section(emit: Emitter, value: str) -> None:
+    emit(f"section {value}")
+
+def str_label(emit: Emitter, value: str) -> None:
+    emit(f"{value}:")
+
+def str_address(emit: Emitter, value: str) -> None:
+    emit(f"mov rax, {value}")
+    emit("push rax")
+
+def str_operator(emit: Emitter, value: str) -> None:
+    if value in SET_BY_OPERATOR:
+        emit("pop rax")
+        emit("pop rdi")
+        emit("xor rsi, rsi")
+        emit("cmp rax, rdi")
+        emit(SET_BY_OPERATOR[value])
+        emit("push rsi")
+    elif value in BINARY_BY_OPERATOR:
+        emit("pop rax")
+        emit("pop rdi")
+        emit(BINARY_BY_OPERATOR[value])
+        emit("push rax")
+    else:
+        raise Exception("invalid string value")
+
+def int_push(emit: Emitter, value: int) -> None:
+    emit(f"push {value}")
+
+def copy_lines(value: int) -> tuple[str, ...]:
+    return (f"mov rax, [rsp + {value * 8}]", "push rax")
+
+def address_lines(value: int) -> tuple[str, ...]:
+    return ("mov rax, rsp", f"add rax, {value * 8}", "push rax")
+
+def drop_lines(value: int) -> tuple[str, ...]:
+    return (f"add rsp, {value * 8}",)
+
+def swap_lines(value: int) -> tuple[str, ...]:
+    return ("mov rax, [rsp]", f"mov rdi, [rsp + {value * 8}]", "mov [rsp], rdi", f"mov [rsp + {value * 8}], rax")
+
+# stack offsets that are common enough to precompute
+CACHED_OFFSETS = range(64)
+COPY_LINES = {n: copy_lines(n) for n in CACHED_OFFSETS}
+ADDRESS_LINES = {n: address_lines(n) for n in CACHED_OFFSETS}
+DROP_LINES = {n: drop_lines(n) for n in CACHED_OFFSETS}
+SWAP_LINES = {n: swap_lines(n) for n in CACHED_OFFSETS}
+
+def int_copy(emit: Emitter, value: int) -> None:
+    for line in COPY_LINES.get(value) or copy_lines(value):
+        emit(line)
+
+def int_address(emit: Emitter, value: int) -> None:
+    for line in ADDRESS_LINES.get(value) or address_lines(value):
+        emit(line)
+
+def int_drop(emit: Emitter, value: int) -> None:
+    for line in DROP_LINES.get(value) or drop_lines(value):
+        emit(line)
+
+def int_swap(emit: Emitter, value: int) -> None:
+    for line in SWAP_LINES.get(value) or swap_lines(value):
+        emit(line)
+
+Function = tuple[tuple[type, ...] | None, Callable[..., None]]
+T0 = TypeVar("T0")
+T1 = TypeVar("T1")
+
+# pairs a handler with its argument types, checked against its parameters by mypy
+@overload
+def function(handler: Callable[[Emitter], None]) -> Function: ...
+@overload
+def function(handler: Callable[[Emitter, T0], None], arg0: type[T0], /) -> Function: ...
+@overload
+def function(handler: Callable[[Emitter, T0, T1], None], arg0: type[T0], arg1: type[T1], /) -> Function: ...
+def function(handler: Callable[..., None], *types: type) -> Function:
+    return (types, handler)
+
+# variadic handler that validates its own arguments
+def variadic(handler: Callable[..., None]) -> Function:
+    return (None, handler)
+
+FUNCTIONS: dict[str, Function] = {
+    "global": function(fn_global, str),
+    "data": variadic(fn_data),
+    "call": function(fn_call, str, int),
+    "syscall": function(fn_syscall, int),
+    "jmp": function(fn_jmp, str),
+    "jmpif": function(fn_jmpif, str),
+    "return": function(fn_return),
+    "args": function(fn_args, int),
+}
+VALUES: dict[tuple[str | None, type], Callable[[Emitter, Any], None]] = {
+    ("#", str): str_load,
+    (".", str): str_section,
+    (":", str): str_label,
+    ("$", str): str_address,
+    (None, str): str_operator,
+    (None, int): int_push,
+    ("$", int): int_copy,
+    ("@", int): int_address,
+    ("?", int): int_drop,
+    (":", int): int_swap,
+}
+
+# tokens are plain tuples tagged by kind
+StringToken = tuple[Literal["string"], bytes] # raw string literal
+ValueToken = tuple[Literal["value"], str | None, str | int] # prefix, value
+FunctionToken = tuple[Literal["function"], str, list[str | int]] # name, args
+Token = StringToken | ValueToken | FunctionToken
 
 class Scanner:
-    _stream: TextIO
-    _c: str
+    _buf: bytes
+    _pos: int
 
-    def __init__(self, stream: TextIO):
-        self._stream = stream
-    
-    def _next(self) -> str:
-        self._c = self._stream.read(1)
-        return self._c
+    def __init__(self, stream: BinaryIO | TextIO):
+        buf = stream.read()
+        if isinstance(buf, str):
+            buf = buf.encode("utf-8")
+        # same newline handling as reading in text mode
+        self._buf = buf.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        self._pos = 0
     
     def scan(self) -> Generator[Token, None, None]:
-        self._next()
-        while self._c:
-            if self._c.isspace():
-                self._next()
-            elif self._c == ";": # comment
-                while self._c and self._c != "\n":
-                    self._next()
-                if self._c:
-                    self._next()
-            elif self._c == '"': # string
-                tk = StringToken("")
-                self._next()
-                while self._c and self._c != '"':
-                    tk.value += self._c
-                    self._next()
-                if not self._c:
+        buf = self._buf
+        pos = self._pos
+        end = len(buf)
+        char_classes = CHAR_CLASSES
+        match_space = SPACE_RE.match
+        match_value = VALUE_RE.match
+        match_arg = ARG_RE.match
+        while pos < end:
+            cls = char_classes[buf[pos]]
+            if cls == CHAR_SPACE:
+                m = match_space(buf, pos)
+                assert m is not None
+                pos = m.end()
+                continue
+            elif cls == CHAR_COMMENT:
+                pos = buf.find(b"\n", pos)
+                if pos < 0:
+                    pos = end
+                continue
+            elif cls == CHAR_STRING:
+                close = buf.find(b'"', pos + 1)
+                if close < 0:
                     raise Exception("unclosed string")
-                self._next()
-                yield tk
-            else: # value/function
-                prefix = None
-                value = ""
-                if self._c in PREFIXES:
-                    prefix = self._c
-                    self._next()
-                while self._c and not self._c.isspace() and self._c != "(":
-                    value += self._c
-                    self._next()
-                if self._c != "(": # value
-                    yield ValueToken(prefix, int(value) if value.isdigit() else value)
-                    continue
-                elif prefix is not None:
-                    raise Exception("functions cannot be prefixed")
-                # function
-                args = []
-                i = 0
-                self._next()
-                while True: # args
-                    while self._c.isspace():
-                        self._next()
-                    if self._c == ")":
-                        break
-                    args.append("")
-                    while self._c and self._c != "," and self._c != ")":
-                        args[i] += self._c
-                        self._next()
-                    if self._c == ",":
-                        self._next()
-                    if args[i].isdigit():
-                        args[i] = int(args[i])
-                    i += 1
-                if not self._c:
+                yield ("string", buf[pos + 1:close])
+                pos = close + 1
+                continue
+            # value/function
+            m = match_value(buf, pos)
+            assert m is not None
+            pos = m.end()
+            prefix, value, function = m.groups()
+            if function is None: # value
+                yield ("value", None if prefix is None else prefix.decode(), int(value) if value.isdigit() else value.decode())
+                continue
+            elif prefix is not None:
+                raise Exception("functions cannot be prefixed")
+            # function
+            args: list[str | int] = []
+            while True: # args
+                m = match_arg(buf, pos)
+                assert m is not None
+                pos = m.end()
+                if m.group("close") is not None:
+                    break
+                if not m.group("comma") and pos >= end:
                     raise Exception("unclosed function")
-                self._next()
-                yield FunctionToken(value, args)
+                arg = m.group("arg")
+                args.append(int(arg) if arg.isdigit() else arg.decode())
+            yield ("function", value.decode(), args)
+        self._pos = pos
                 
 class Compiler:
     _stream: Iterator[Token]
@@ -160,97 +307,40 @@ class Compiler:
     def __init__(self, stream: Iterator[Token]):
         self._stream = stream
     
-    def compile(self) -> Generator[str, None, None]:
+    def compile(self, emit: Emitter) -> None:
+        values = VALUES
+        functions = FUNCTIONS
         for tk in self._stream:
-            if isinstance(tk, StringToken):
-                yield asm_str(tk.value)
-            elif isinstance(tk, FunctionToken):
-                if tk.name == "global" and len(tk.args) == 1 and isinstance(tk.args[0], str):
-                    yield "global %s" % (tk.args[0])
-                elif tk.name == "data" and len(tk.args) >= 2 and tk.args[0] in TYPES and all(isinstance(arg, int) for arg in tk.args[1:]):
-                    yield "d%s %s" % (
-                        TYPES[tk.args[0]],
-                        ", ".join(str(arg) for arg in tk.args[1:])
-                    )
-                elif tk.name == "call" and len(tk.args) == 2 and isinstance(tk.args[0], str) and isinstance(tk.args[1], int):
-                    for i in reversed(range(tk.args[1])):
-                        yield "pop %s" % (CALL_ARG_REGS[i])
-                    yield "call %s" % (tk.args[0])
-                    yield "push rax"
-                elif tk.name == "syscall" and len(tk.args) == 1 and isinstance(tk.args[0], int):
-                    for i in reversed(range(tk.args[0])):
-                        yield "pop %s" % (SYSCALL_ARG_REGS[i])
-                    yield "syscall"
-                    yield "push rax"
-                elif tk.name == "jmp" and len(tk.args) == 1 and isinstance(tk.args[0], str):
-                    yield "jmp %s" % (tk.args[0])
-                elif tk.name == "jmpif" and len(tk.args) == 1 and isinstance(tk.args[0], str):
-                    yield "pop rax"
-                    yield "test rax, rax"
-                    yield "jnz %s" % (tk.args[0])
-                elif tk.name == "return" and len(tk.args) == 0:
-                    yield "pop rax"
-                    yield "ret"
-                elif tk.name == "args" and len(tk.args) == 1 and isinstance(tk.args[0], int):
-                    for i in range(tk.args[0]):
-                        yield "push %s" % (CALL_ARG_REGS[i])
-                else:
+            if tk[0] == "value":
+                handler = values.get((tk[1], type(tk[2])))
+                if handler is None:
+                    raise Exception("invalid %s value" % ("string" if type(tk[2]) is str else "integer"))
+                handler(emit, tk[2])
+            elif tk[0] == "function":
+                entry = functions.get(tk[1])
+                if entry is None:
+                    raise Exception("invalid function")
+                signature, fn = entry
+                if signature is not None and tuple(map(type, tk[2])) != signature:
                     raise Exception("invalid function")
-            elif isinstance(tk, ValueToken) and isinstance(tk.value, str):
-                if tk.prefix == "#" and tk.value in TYPES:
-                    yield "pop rax"
-                    yield "xor rdi, rdi"
-                    yield "mov %s, %s [rax]" % (RDI_BY_SIZE[tk.value], tk.value)
-                    yield "push rdi"
-                elif tk.prefix == ".":
-                    yield "section %s" % (tk.value)
-                elif tk.prefix == ":":
-                    yield "%s:" % (tk.value)
-                elif tk.prefix == "$":
-                    yield "mov rax, %s" % (tk.value)
-                    yield "push rax"
-                elif tk.prefix is None and tk.value in CONDITIONAL_OPERATORS:
-                    yield "pop rax"
-                    yield "pop rdi"
-                    yield "xor rsi, rsi"
-                    yield "cmp rax, rdi"
-                    yield "set%s sil" % (CONDITIONAL_OPERATORS[tk.value])
-                    yield "push rsi"
-                elif tk.prefix is None and tk.value in SIMPLE_BINARY_OPERATORS:
-                    yield "pop rax"
-                    yield "pop rdi"
-                    yield "%s rax, rdi" % (SIMPLE_BINARY_OPERATORS[tk.value])
-                    yield "push rax"
-                else:
-                    raise Exception("invalid string value")
-            elif isinstance(tk, ValueToken) and isinstance(tk.value, int):
-                if tk.prefix is None:
-                    yield "push %i" % (tk.value)
-                elif tk.prefix == "$":
-                    yield "mov rax, [rsp + %i]" % (tk.value * 8)
-                    yield "push rax"
-                elif tk.prefix == "@":
-                    yield "mov rax, rsp"
-                    yield "add rax, %i" % (tk.value * 8)
-                    yield "push rax"
-                elif tk.prefix == "?":
-                    yield "add rsp, %i" % (tk.value * 8)
-                elif tk.prefix == ":":
-                    yield "mov rax, [rsp]"
-                    yield "mov rdi, [rsp + %i]" % (tk.value * 8)
-                    yield "mov [rsp], rdi"
-                    yield "mov [rsp + %i], rax" % (tk.value * 8)
-                else:
-                    raise Exception("invalid integer value")
+                fn(emit, *tk[2])
+            elif tk[0] == "string":
+                emit(asm_str(tk[1]))
             else:
                 raise Exception("invalid token")
 
-if __name__ == "__main__":
+def main() -> None:
     parser = ArgumentParser()
     parser.add_argument("input", type=str)
     parser.add_argument("output", type=str)
     args = parser.parse_args()
 
-    with open(args.input, "r") as input, open(args.output, "w") as output:
-        for line in Compiler(Scanner(input).scan()).compile():
-            output.write(line + "\n")
+    with open(args.input, "rb") as input, open(args.output, "w") as output:
+        lines: list[str] = []
+        Compiler(Scanner(input).scan()).compile(lines.append)
+        if lines:
+            output.write("\n".join(lines))
+            output.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+    name="rpasm",
+    version="0.1.0",
+    python_requires=">=3.10",
+    py_modules=["rpasm"],
+    ext_modules=mypycify(["rpasm.py"]),
+    entry_points={
+        "console_scripts": ["rpasm = rpasm:main"],
+    },
+)